@@ -2076,7 +2076,7 @@ class Builder:
 
         # create destination feeds index
         with open(dst_feeds_index, 'w') as dst_packages:
-            for package in sorted(feeds_packages | feeds_base_index):
+            for package in Packages.sorted_by_filename(feeds_packages | feeds_base_index):
                 for attribute, value in package:
                     if value is not None:
                         dst_packages.write('{}: {}\n'.format(attribute, value))
@@ -2111,8 +2111,7 @@ class Builder:
                     feeds_base_index = {package for package in base_packages}
             else:
                 feeds_base = urlopen(Request(feeds_base_url, headers={'User-Agent': 'Mozilla/5.0'}))
-                feeds_base = feeds_base.read().decode('utf-8')
-                base_packages = Packages(feeds_base_url, iter(feeds_base.splitlines()))
+                base_packages = Packages(feeds_base_url, feeds_base.read())
                 feeds_base_index = {package for package in base_packages}
 
         # prepare base feeds index
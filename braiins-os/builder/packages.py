@@ -20,11 +20,24 @@
 # of such proprietary license or if you have any other questions, please
 # contact us at opensource@braiins.com.
 
-from itertools import chain
+import os
+import re
+import mmap
+
+from operator import attrgetter
 from collections import OrderedDict
 
+# attribute name with its value including continuation lines
+_ATTR_RE = re.compile(rb'^([^:\s]+): (.*(?:\n[ \t].*)*)', re.M)
+# trailing white space on each line of attribute value
+_TRAILING_SPACE_RE = re.compile(rb'[ \t\r\f\v]+\n')
+# sort key with cached package file name
+_FILENAME_KEY = attrgetter('_filename')
+
 
 class Package:
+    __slots__ = ('_attributes', '_name', '_version', '_filename', '_hash')
+
     # feeds index constants
     FEEDS_ATTR_PACKAGE = 'Package'
     FEEDS_ATTR_FILENAME = 'Filename'
@@ -34,15 +47,15 @@ class Package:
 
     @property
     def name(self):
-        return self._attributes.get(self.FEEDS_ATTR_PACKAGE)
+        return self._name
 
     @property
     def filename(self):
-        return self._attributes.get(self.FEEDS_ATTR_FILENAME)
+        return self._filename
 
     @property
     def version(self):
-        return self._attributes.get(self.FEEDS_ATTR_VERSION)
+        return self._version
 
     @property
     def require(self):
@@ -54,17 +67,22 @@ class Package:
 
     def __init__(self, attributes):
         self._attributes = attributes
+        # attributes identifying the package are never changed so cache them
+        self._name = attributes.get(self.FEEDS_ATTR_PACKAGE)
+        self._version = attributes.get(self.FEEDS_ATTR_VERSION)
+        self._filename = attributes.get(self.FEEDS_ATTR_FILENAME)
+        self._hash = hash((self._name, self._version))
 
     def __hash__(self):
-        return hash((self.name, self.version))
+        return self._hash
 
     def __eq__(self, other):
         if not isinstance(other, type(self)):
             return NotImplemented
-        return self.name == other.name and self.version == other.version
+        return self._name == other._name and self._version == other._version
 
     def __lt__(self, other):
-        return self.filename < other.filename
+        return self._filename < other._filename
 
     def __iter__(self):
         for attribute, value in self._attributes.items():
@@ -72,6 +90,51 @@ class Package:
                 yield attribute, value
 
 
+def _parse_record(record):
+    """
+    Parse one package record from feeds index
+
+    :param record:
+        Bytes with all attribute lines of one package record.
+    :return:
+        Dictionary with package attributes.
+    """
+    # keep attributes in order of feeds index also on python 3.5 which is used by builder
+    attributes = OrderedDict()
+    # attribute has format 'name: value\n' and the value continues on following lines starting with space
+    for attribute, value in _ATTR_RE.findall(record):
+        # decode only extracted fields instead of the whole file
+        attribute = attribute.decode()
+        attributes[attribute] = _TRAILING_SPACE_RE.sub(b'\n', value).rstrip().decode()
+        if attribute == Package.FEEDS_ATTR_VERSION and not attributes.get(Package.FEEDS_ATTR_REQUIRE):
+            attributes[Package.FEEDS_ATTR_REQUIRE] = None
+    if Package.FEEDS_ATTR_REQUIRE not in attributes:
+        attributes[Package.FEEDS_ATTR_REQUIRE] = None
+    return attributes
+
+
+def _parse_records(data):
+    """
+    Iterate through all package records in feeds index
+
+    :param data:
+        Bytes like object with feeds index.
+    :return:
+        Dictionary with attributes for each package record.
+    """
+    start = 0
+    end = len(data)
+    while start < end:
+        # records are separated by empty line
+        record_end = data.find(b'\n\n', start, end)
+        if record_end < 0:
+            record_end = end
+        record = data[start:record_end]
+        if record.strip():
+            yield _parse_record(record)
+        start = record_end + 2
+
+
 class Packages:
     """
     Class for parsing LEDE feeds index with packages
@@ -82,74 +145,54 @@ class Packages:
 
         :param path:
             File path to feeds index file.
+        :param input:
+            Optional content of feeds index used instead of the file.
         """
         self._path = path
-        self._input = input
+        self._file = None
+        self._data = input
 
     def __enter__(self):
         """
-        Open feeds index file
+        Open feeds index file and map it to memory
 
         :return:
             Feeds index file parser.
         """
-        self._input = open(self._path, 'r')
+        self._file = open(self._path, 'rb')
+        if os.fstat(self._file.fileno()).st_size:
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            # empty file cannot be mapped
+            self._data = b''
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         """
         Close previously opend feeds index file
         """
-        self._input.close()
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
 
-    def _get_package_record(self, stream):
+    @staticmethod
+    def sorted_by_filename(packages):
         """
+        Sort packages by their file names
 
-        :param stream:
+        :param packages:
+            Iterable with packages.
         :return:
+            New sorted list of packages.
         """
-        attributes = OrderedDict()
-        attribute = None
-        value = None
-        for line in stream:
-            if not len(line) or line[0] == '\n':
-                # end of record
-                break
-            if not line[0].isspace():
-                # found new package attribute
-                if attribute:
-                    # store previous attribute
-                    attributes[attribute] = value
-                    if attribute == Package.FEEDS_ATTR_VERSION and not attributes.get(Package.FEEDS_ATTR_REQUIRE):
-                        attributes[Package.FEEDS_ATTR_REQUIRE] = None
-                # attribute has format 'name: value\n'
-                attribute, value = line.split(': ', 1)
-                # remove newline
-                value = value.rstrip()
-            else:
-                # when newline starts with space then previous attribute value continues
-                value = '{}\n{}'.format(value, line.rstrip())
-        if attribute:
-            # store previous attribute
-            attributes[attribute] = value
-        if Package.FEEDS_ATTR_REQUIRE not in attributes:
-            attributes[Package.FEEDS_ATTR_REQUIRE] = None
-        return Package(attributes)
+        return sorted(packages, key=_FILENAME_KEY)
 
     def __iter__(self):
         """
         Iterate through all package records in feeds index file
 
         :return:
-            Ordered dictionary with attribute records for one package.
+            Package for each record in feeds index.
         """
-        while True:
-            # find first attribute
-            for line in self._input:
-                if len(line) and not line[0].isspace():
-                    break
-            else:
-                # no more data so break outer cycle
-                break
-            # read the whole record
-            yield self._get_package_record(chain((line,), self._input))
+        for attributes in _parse_records(self._data):
+            yield Package(attributes)
@@ -29,7 +29,8 @@ Basicaly it takes a file given as first arg, copies it onto device specified
 in config file or as additional argument, runs it, and returns its return code.
 It is intended to be used as a custom runner in cargo config for crosscompiled
 parts of project.
-ssh & scp does all the legwork, openwrt's "lock" is used to handle concurrency
+ssh & scp does all the legwork (compressed file is piped through ssh to gunzip),
+openwrt's "lock" is used to handle concurrency
 and --test-threads 1 is passed to commands that look like a cargo tests.
 Unrecognized args are passed along to target binary.
 """
@@ -38,13 +39,18 @@ import sys
 import os.path
 import re
 import argparse
-import toml
 import subprocess
 import shutil
 
 CONFIG_FILE = 'Test.toml'
+CONFIG_CACHE_SUFFIX = '.cache.json'
 DEFAULT_USER = 'root'
 CONFIG_PATHS = ['.', '..']
+# all config file locations
+CONFIG_LOCATIONS = tuple(os.path.join(dir, CONFIG_FILE) for dir in CONFIG_PATHS)
+
+# stuff resembling cargo tests (file ends with a dash followed by sixteen hex digits)
+is_test_harness = re.compile(r'.-[0-9a-f]{16}\Z').search
 
 
 def main():
@@ -75,17 +81,19 @@ def main():
     cfg_user = None
     cfg_hostname = None
 
-    # construct all config file locations
-    cfg_locations = [os.path.join(dir, CONFIG_FILE) for dir in CONFIG_PATHS]
-    cfg_path = next((path for path in cfg_locations if os.path.isfile(path)), None)
+    # configuration file is not needed when all remote settings are passed as arguments
+    need_config = not (args.user and args.hostname)
+
+    if need_config:
+        cfg_path = next((path for path in CONFIG_LOCATIONS if os.path.isfile(path)), None)
 
-    if cfg_path is not None:
-        # try to get default configuration from configuration file
-        config = toml.load(cfg_path)
-        remote = config.get('remote')
-        if remote:
-            cfg_user = remote.get('user')
-            cfg_hostname = remote.get('hostname')
+        if cfg_path is not None:
+            # try to get default configuration from configuration file
+            config = load_config(cfg_path)
+            remote = config.get('remote')
+            if remote:
+                cfg_user = remote.get('user')
+                cfg_hostname = remote.get('hostname')
 
     # get remote settings
     user = args.user or cfg_user or DEFAULT_USER
@@ -97,12 +105,18 @@ def main():
 
     test_path = args.test
     test_name = os.path.basename(args.test)
-    # stuff resembling cargo tests (file ends with a dash followed by sixteen hex digits)
-    # is automagically endowed with param to enforce single thread to ensure exclusive access to hw
-    remote_argv = ['--test-threads', '1'] if re.match('.+-[0-9a-f]{16}$', args.test) else []
+    # cargo tests are automagically endowed with param to enforce single thread to ensure exclusive access to hw
+    remote_argv = ['--test-threads', '1'] if is_test_harness(args.test) else []
     remote_argv += extra_args
     remote_test = os.path.join(args.host_path, test_name)
     common_args = ['-o', 'StrictHostKeyChecking=no']
+    # share one multiplexed connection among all ssh & scp invocations of this runner,
+    # the master is established by first ssh call and it is closed at the end
+    common_args += [
+        '-o', 'ControlMaster=auto',
+        '-o', 'ControlPath=/tmp/bosrunner-{}-%r@%h:%p'.format(os.getpid()),
+        '-o', 'ControlPersist=60s',
+    ]
 
     if args.apply:
         test_path = shutil.copy(args.test, '/tmp')
@@ -114,82 +128,152 @@ def main():
             check=True,
         )
 
-    if args.compress:
-        runner(
-            'gzip',
-            '--keep',
-            '--force',
-            test_path
-        )
-        compression_suffix = '.gz'
-    else:
-        compression_suffix = ''
-
-
     if not args.verbose:
         # suppress message 'Connection to XYZ closed.'
         common_args.append('-q')
 
-    # create target dir if not exist and acquire a lock, in case multiple runners meet.
-    # note this locking is openwrt specific, and unlike flock have to be explicitely unlocked
-    run_lock = runner(
-        'ssh',
-        *common_args,
-        '-l', user,
-        hostname,
-        'mkdir -p ' + args.host_path + ' && lock /tmp/testrunner',
-        check=True,
-    )
-
+    # the first ssh call becomes master of shared connection so tear it down even when locking fails
     try:
-        if args.verbose:
-            print('copying %d bytes' % os.path.getsize(test_path))
-        cpy_ret = runner(
-            'scp',
-            '-q',   # no progressbar
-            '-C',   # enable compression
+        # create target dir if not exist and acquire a lock, in case multiple runners meet.
+        # note this locking is openwrt specific, and unlike flock have to be explicitely unlocked
+        run_lock = runner(
+            'ssh',
             *common_args,
-            test_path + compression_suffix,
-            '{}@{}:{}'.format(user, hostname, args.host_path),
+            '-l', user,
+            hostname,
+            'mkdir -p ' + args.host_path + ' && lock /tmp/testrunner',
             check=True,
         )
 
-        if args.compress:
-            run_dec = runner(
+        try:
+            if args.verbose:
+                print('copying %d bytes' % os.path.getsize(test_path))
+            if args.compress:
+                # stream compressed file over shared connection and decompress it on the fly,
+                # busybox gunzip is available on every device unlike rsync
+                send_compressed(
+                    test_path,
+                    'ssh',
+                    *common_args,
+                    '-l', user,
+                    hostname,
+                    'gunzip -c > {0} && chmod +x {0}'.format(remote_test),
+                    verbose=args.verbose,
+                )
+            else:
+                cpy_ret = runner(
+                    'scp',
+                    '-q',   # no progressbar
+                    '-C',   # enable compression
+                    *common_args,
+                    test_path,
+                    '{}@{}:{}'.format(user, hostname, args.host_path),
+                    check=True,
+                )
+
+            run_ret = runner(
                 'ssh',
                 *common_args,
+                '-t',   # force pty
                 '-l', user,
                 hostname,
-                'gunzip ' + remote_test + compression_suffix,
-                check=True,
+                remote_test + ' ' + ' '.join(remote_argv),
+                check=False,
             )
 
-        run_ret = runner(
-            'ssh',
-            *common_args,
-            '-t',   # force pty
-            '-l', user,
-            hostname,
-            remote_test + ' ' + ' '.join(remote_argv),
-            check=False,
-        )
+        finally:
+            # clean up code and lock
+            clean_ret = runner(
+                'ssh',
+                *common_args,
+                '-l', user,
+                hostname,
+                ('rm -f ' + remote_test + ' ; ' if not args.keep else '') + 'lock -u /tmp/testrunner',
+                check=True,
+            )
 
     finally:
-        # clean up code and lock
-        clean_ret = runner(
+        # tear down shared connection
+        runner(
             'ssh',
             *common_args,
+            '-O', 'exit',
             '-l', user,
             hostname,
-            ('rm -f ' + remote_test + ' ; ' if not args.keep else '') + 'lock -u /tmp/testrunner',
-            check=True,
+            check=False,
         )
 
     sys.exit(run_ret.returncode)
 
 
+def load_config(cfg_path):
+    """load toml configuration using pre-compiled json cache when it is up to date"""
+    # parsers are imported only when configuration file is really used
+    import json
+
+    cache_path = cfg_path + CONFIG_CACHE_SUFFIX
+    # cache is valid only for exactly the same configuration file, older mtime does not
+    # mean older content (e.g. after 'git checkout' or 'cp -p')
+    cfg_stat = os.stat(cfg_path)
+    source = [cfg_stat.st_mtime_ns, cfg_stat.st_size]
+    try:
+        with open(cache_path) as cache:
+            cache = json.load(cache)
+        if cache['source'] == source:
+            return cache['config']
+    except (OSError, ValueError, KeyError, TypeError):
+        # missing or broken cache is re-created from configuration file
+        pass
+
+    try:
+        import tomllib
+    except ImportError:
+        import tomli as tomllib
+    with open(cfg_path, 'rb') as file:
+        config = tomllib.load(file)
+    try:
+        # serialize first so unsupported values (e.g. toml dates) do not leave partial cache
+        data = json.dumps({'source': source, 'config': config})
+        # replace cache atomically so concurrent runners never read partially written file
+        tmp_path = '{}.{}'.format(cache_path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as cache:
+                cache.write(data)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+    except (OSError, TypeError):
+        # cache is only optional optimization
+        pass
+    return config
+
+
+def send_compressed(path, *args, verbose=False):
+    """compress file on the fly and pipe it to stdin of executed command"""
+    import gzip
+
+    if verbose:
+        print(' '.join(args), flush=True)
+    # unbuffered pipe so closing it after broken pipe does not try to flush again
+    with open(path, 'rb') as file, subprocess.Popen(args, stdin=subprocess.PIPE, bufsize=0) as proc:
+        try:
+            with gzip.GzipFile(fileobj=proc.stdin, mode='wb', compresslevel=1) as stream:
+                shutil.copyfileobj(file, stream, 1 << 20)
+        except BrokenPipeError:
+            # command failed prematurely and its return code is checked below
+            pass
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, args)
+
+
 def run_silent(*args, **kargs):
     """wrapper over subprocess for nicer call format"""
+    # subprocess uses posix_spawn instead of fork only for program given by path,
+    # inherited descriptors are still closed so they do not leak to persistent ssh master
+    if not kargs.get('shell'):
+        args = (shutil.which(args[0]) or args[0],) + args[1:]
     return subprocess.run(args, **kargs)
 
 